@@ -1,10 +1,20 @@
 import requests
+import orjson
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
+import numpy as np
 import psycopg2
 from psycopg2.extras import execute_values
 import logging
+import io
+import itertools
+import queue
+import time
 from datetime import datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
 # Configure logging
@@ -24,6 +34,13 @@ DB_PORT = os.getenv('DB_PORT', '5432')
 DB_NAME = os.getenv('DB_NAME', 'weather_data')
 DB_USER = os.getenv('DB_USER', 'postgres')
 DB_PASSWORD = os.getenv('DB_PASSWORD', 'password')
+DB_CFG = dict(
+    host=DB_HOST,
+    port=DB_PORT,
+    database=DB_NAME,
+    user=DB_USER,
+    password=DB_PASSWORD
+)
 
 # OpenWeatherMap API Configuration
 API_KEY = os.getenv('WEATHER_API_KEY') # API key for OpenWeatherMap
@@ -37,60 +54,214 @@ CITIES = [
 
 # List of cities to get weather data for
 WEATHER_API_URL = "https://api.openweathermap.org/data/2.5/weather"
+API_TIMEOUT = (3, 10)  # (connect, read) timeouts in seconds
+MAX_WORKERS = 16  # concurrent API requests, also the HTTP connection pool size
+
+# Shared HTTP session so connections to the API are kept alive and reused
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=MAX_WORKERS,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504]
+    )
+))
+
+# Columns produced by the extraction phase, in DataFrame order
+RAW_COLUMNS = (
+    'city',
+    'country',
+    'temperature',
+    'feels_like',
+    'humidity',
+    'pressure',
+    'wind_speed',
+    'weather_main',
+    'weather_description',
+    'timestamp',
+    'sunrise',
+    'sunset'
+)
+
+# Low-cardinality text columns stored as pandas categoricals
+CATEGORICAL_COLUMNS = [
+    'city',
+    'country',
+    'weather_main',
+    'weather_description',
+    'day_night',
+    'temp_category',
+    'data_quality'
+]
+
+# Target table columns, in CREATE TABLE order (excluding the SERIAL id)
+COLUMNS = (
+    'city',
+    'country',
+    'temperature',
+    'temperature_f',
+    'feels_like',
+    'feels_like_f',
+    'humidity',
+    'pressure',
+    'wind_speed',
+    'weather_main',
+    'weather_description',
+    'timestamp',
+    'sunrise',
+    'sunset',
+    'day_night',
+    'temp_category',
+    'data_quality',
+    'etl_timestamp'
+)
+
+# Load statements are fixed by the schema, so build them once at import.
+# Rows land in an UNLOGGED staging table and are moved server-side.
+COLUMNS_STR = ', '.join(COLUMNS)
+INSERT_SQL = f"""
+INSERT INTO current_weather_stage ({COLUMNS_STR})
+VALUES %s
+"""
+INSERT_TEMPLATE = "(" + ", ".join(["%s"] * len(COLUMNS)) + ")"
+COPY_SQL = f"""
+COPY current_weather_stage ({COLUMNS_STR})
+FROM STDIN WITH (FORMAT CSV, NULL '\\N')
+"""
+TRUNCATE_STAGE_SQL = "TRUNCATE current_weather_stage"
+MOVE_STAGE_SQL = f"""
+INSERT INTO current_weather ({COLUMNS_STR})
+SELECT {COLUMNS_STR} FROM current_weather_stage
+"""
+
+# Streaming pipeline: rows per transform/load batch, and the longest time
+# (in seconds) a partial batch waits before it is flushed anyway
+BATCH_SIZE = 1000
+BATCH_TIMEOUT = 5.0
+
+# Full batches are loaded with COPY, smaller partial flushes with INSERT
+COPY_THRESHOLD = BATCH_SIZE
+
+# Bounded stage queues so a slow stage pushes back on the one before it,
+# and how often (in seconds) a blocked producer checks its consumer is alive
+RAW_QUEUE_SIZE = BATCH_SIZE
+LOAD_QUEUE_SIZE = 2
+QUEUE_POLL_INTERVAL = 0.5
+
+# Queue markers: the stream finished cleanly, or an upstream stage failed
+STREAM_END = object()
+STREAM_ABORT = object()
 
-def extract():
+def resolve_local_timezone():
     """
-    Extract weather data from OpenWeatherMap API for multiple cities
+    Resolve the host's IANA time zone from TZ or /etc/localtime, falling
+    back to LOCAL_TIMEZONE (default UTC) when neither names a known zone
+    """
+    candidates = [os.getenv('TZ', '').lstrip(':')]
+    if os.path.islink('/etc/localtime'):
+        candidates.append(os.path.realpath('/etc/localtime').split('zoneinfo/', 1)[-1])
+    candidates.append(os.getenv('LOCAL_TIMEZONE', 'UTC'))
+    
+    for name in candidates:
+        if not name:
+            continue
+        try:
+            return ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError):
+            continue
+    
+    return ZoneInfo('UTC')
+
+# Resolved once: pandas vectorizes ZoneInfo conversions, unlike dateutil's tzlocal()
+LOCAL_TZ = resolve_local_timezone()
+
+def fetch_city_weather(city):
+    """
+    Fetch the raw weather JSON for a single city from OpenWeatherMap API
+    """
+    # Set up parameters for the API request
+    params = {
+        'q': city,
+        'appid': API_KEY,
+        'units': 'metric'  # Use Celsius for temperature
+    }
+    
+    # Make API request
+    response = SESSION.get(WEATHER_API_URL, params=params, timeout=API_TIMEOUT)
+    response.raise_for_status()  # Raise an exception for HTTP errors
+    
+    # Decode the raw bytes with orjson, which is much faster than response.json()
+    return orjson.loads(response.content)
+
+def build_dataframe(records):
+    """
+    Flatten (city, weather JSON) pairs into a DataFrame
     Returns a pandas DataFrame with the extracted data
     """
+    # Build the DataFrame column-wise to avoid a records-to-columns transpose
+    cols = {name: [] for name in RAW_COLUMNS}
+    
+    for city, weather_data in records:
+        # Extract relevant fields (flattening the nested JSON)
+        cols['city'].append(city)
+        cols['country'].append(weather_data['sys']['country'])
+        cols['temperature'].append(weather_data['main']['temp'])
+        cols['feels_like'].append(weather_data['main']['feels_like'])
+        cols['humidity'].append(weather_data['main']['humidity'])
+        cols['pressure'].append(weather_data['main']['pressure'])
+        cols['wind_speed'].append(weather_data['wind']['speed'])
+        cols['weather_main'].append(weather_data['weather'][0]['main'])
+        cols['weather_description'].append(weather_data['weather'][0]['description'])
+        cols['timestamp'].append(weather_data['dt'])
+        cols['sunrise'].append(weather_data['sys']['sunrise'])
+        cols['sunset'].append(weather_data['sys']['sunset'])
+    
+    # Convert dictionary of columns to DataFrame
+    df = pd.DataFrame(cols, copy=False)
+    
+    # Downcast integer readings; humidity is 0-100 and pressure ~1000 hPa
+    df = df.astype({'humidity': 'int16', 'pressure': 'int32'})
+    
+    # Convert unix seconds to naive local datetimes, one column at a time
+    for column in ('timestamp', 'sunrise', 'sunset'):
+        df[column] = (
+            pd.to_datetime(df[column], unit='s', utc=True)
+            .dt.tz_convert(LOCAL_TZ)
+            .dt.tz_localize(None)
+        )
+    
+    return df
+
+def extract_stream():
+    """
+    Extract weather data from OpenWeatherMap API for multiple cities
+    Generator: yields (city, weather JSON) pairs as each response arrives
+    """
     logger.info("Starting extraction phase...")
     
     if not API_KEY:
         logger.error("No API key found. Set WEATHER_API_KEY in your .env file")
         raise ValueError("Missing API key")
     
-    all_weather_data = []
-    
     try:
-        for city in CITIES:
-            # Set up parameters for the API request
-            params = {
-                'q': city,
-                'appid': API_KEY,
-                'units': 'metric'  # Use Celsius for temperature
-            }
-            
-            # Make API request
-            response = requests.get(WEATHER_API_URL, params=params)
-            response.raise_for_status()  # Raise an exception for HTTP errors
-            
-            # Get the data as JSON
-            weather_data = response.json()
+        # Never run more threads than the session has pooled connections
+        with ThreadPoolExecutor(max_workers=max(1, min(len(CITIES), MAX_WORKERS))) as executor:
+            fetches = {executor.submit(fetch_city_weather, city): city for city in CITIES}
             
-            # Extract relevant fields (flattening the nested JSON)
-            processed_data = {
-                'city': city,
-                'country': weather_data['sys']['country'],
-                'temperature': weather_data['main']['temp'],
-                'feels_like': weather_data['main']['feels_like'],
-                'humidity': weather_data['main']['humidity'],
-                'pressure': weather_data['main']['pressure'],
-                'wind_speed': weather_data['wind']['speed'],
-                'weather_main': weather_data['weather'][0]['main'],
-                'weather_description': weather_data['weather'][0]['description'],
-                'timestamp': datetime.fromtimestamp(weather_data['dt']),
-                'sunrise': datetime.fromtimestamp(weather_data['sys']['sunrise']),
-                'sunset': datetime.fromtimestamp(weather_data['sys']['sunset'])
-            }
-            
-            all_weather_data.append(processed_data)
-            logger.info(f"Extracted weather data for {city}")
-        
-        # Convert list of dictionaries to DataFrame
-        df = pd.DataFrame(all_weather_data)
+            try:
+                # Hand each payload on as soon as it arrives
+                for future in as_completed(fetches):
+                    city = fetches[future]
+                    yield city, future.result()
+                    logger.info(f"Extracted weather data for {city}")
+            finally:
+                # Skip requests not yet started if the stream stops early
+                for future in fetches:
+                    future.cancel()
         
-        logger.info(f"Extracted weather data for {len(df)} cities")
-        return df
+        logger.info(f"Extracted weather data for {len(fetches)} cities")
     
     except requests.exceptions.RequestException as e:
         logger.error(f"Error extracting data from Weather API: {e}")
@@ -108,43 +279,29 @@ def transform(df):
         df['etl_timestamp'] = datetime.now()
         
         # Calculate day/night status
-        def is_daytime(row):
-            current_time = row['timestamp']
-            sunrise = row['sunrise']
-            sunset = row['sunset']
-            return 'Day' if sunrise <= current_time <= sunset else 'Night'
-        
-        df['day_night'] = df.apply(is_daytime, axis=1)
+        is_daytime = (df['sunrise'] <= df['timestamp']) & (df['timestamp'] <= df['sunset'])
+        df['day_night'] = np.where(is_daytime, 'Day', 'Night')
         
         # Convert temperature to Fahrenheit for additional data
-        df['temperature_f'] = df['temperature'] * 9/5 + 32
-        """ 
-        # Equivalent Excel transformation:  
-        excel_df['Profit'] = excel_df['Revenue'] - excel_df['Cost']  
-        """
-        df['feels_like_f'] = df['feels_like'] * 9/5 + 32
+        # Both columns are converted in a single pass over a 2-column block
+        df[['temperature_f', 'feels_like_f']] = df[['temperature', 'feels_like']].to_numpy() * 1.8 + 32.0
         
         # Create temperature category
-        def temp_category(temp):
-            if temp < 0:
-                return 'Very Cold'
-            elif temp < 10:
-                return 'Cold'
-            elif temp < 20:
-                return 'Mild'
-            elif temp < 30:
-                return 'Warm'
-            else:
-                return 'Hot'
-        
-        df['temp_category'] = df['temperature'].apply(temp_category)
+        # Bins are left-closed so e.g. exactly 10°C is 'Mild', not 'Cold'
+        df['temp_category'] = pd.cut(
+            df['temperature'],
+            bins=[-np.inf, 0, 10, 20, 30, np.inf],
+            labels=['Very Cold', 'Cold', 'Mild', 'Warm', 'Hot'],
+            right=False
+        )
         
         # Add weather data quality flag
-        df['data_quality'] = 'Good'  # Default value
+        # Suspicious if over 50°C or below -50°C
+        df['data_quality'] = np.where(df['temperature'].abs() > 50, 'Suspicious', 'Good')
         
-        # Mark suspicious data
-        df.loc[df['temperature'] > 50, 'data_quality'] = 'Suspicious'  # Suspicious if over 50°C
-        df.loc[df['temperature'] < -50, 'data_quality'] = 'Suspicious'  # Suspicious if below -50°C
+        # Dictionary-encode repeated strings to cut per-cell object overhead
+        for column in CATEGORICAL_COLUMNS:
+            df[column] = df[column].astype('category')
         
         logger.info("Data transformation completed")
         return df
@@ -153,11 +310,12 @@ def transform(df):
         logger.error(f"Error transforming data: {e}")
         raise
 
-def create_table():
+def create_table(cur):
     """
-    Create the target table in PostgreSQL if it doesn't exist
+    Create the target and staging tables in PostgreSQL if they don't exist
+    using the given cursor
     """
-    create_table_query = """
+    create_table_query = f"""
     CREATE TABLE IF NOT EXISTS current_weather (
         id SERIAL PRIMARY KEY,
         city TEXT,
@@ -179,92 +337,214 @@ def create_table():
         data_quality TEXT,
         etl_timestamp TIMESTAMP
     );
+    
+    CREATE UNLOGGED TABLE IF NOT EXISTS current_weather_stage AS
+    SELECT {COLUMNS_STR} FROM current_weather WITH NO DATA;
     """
     
     try:
-        # Connect to the PostgreSQL database
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        
-        # Create a cursor
-        with conn.cursor() as cur:
-            cur.execute(create_table_query)
-            conn.commit()
-            logger.info("Target table created or already exists")
-        
-        conn.close()
+        cur.execute(create_table_query)
+        logger.info("Target and staging tables created or already exist")
     
     except Exception as e:
         logger.error(f"Error creating table: {e}")
         raise
 
-def load(df):
+def stage_batch(cur, df):
     """
-    Load the transformed weather data into PostgreSQL
+    Write one DataFrame batch into the PostgreSQL staging table
     """
-    logger.info("Starting loading phase...")
+    # Select columns in table order so rows always line up with the SQL
+    df = df[list(COLUMNS)]
     
-    try:
-        # Connect to the PostgreSQL database
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
+    if len(df) >= COPY_THRESHOLD:
+        # Stream the batch as CSV through a single COPY for large loads
+        buffer = io.StringIO()
+        df.to_csv(buffer, index=False, header=False, na_rep='\\N')
+        buffer.seek(0)
         
-        # Create table if it doesn't exist
-        create_table()
+        cur.copy_expert(COPY_SQL, buffer)
+    else:
+        # Stream plain tuples straight from the DataFrame
+        data_iter = df.itertuples(index=False, name=None)
         
-        # Prepare data for insertion
-        columns = df.columns.tolist()
+        # One page for the whole batch and a fixed template skip per-row heuristics
+        execute_values(
+            cur,
+            INSERT_SQL,
+            data_iter,
+            template=INSERT_TEMPLATE,
+            page_size=max(1000, len(df))
+        )
+
+def load_batches(batches):
+    """
+    Load an iterable of transformed weather DataFrames into PostgreSQL
+    All batches are committed in one transaction, or none are.
+    To load a single DataFrame, pass it as [df].
+    """
+    logger.info("Starting loading phase...")
+    
+    conn = None
+    try:
+        # Wait for the first batch before connecting, so no connection,
+        # transaction or stage lock is held while upstream is still fetching
+        batches = iter(batches)
+        first_batch = next(batches, None)
+        if first_batch is None:
+            logger.info("No weather records to load")
+            return
         
-        # Convert DataFrame to list of tuples
-        data_tuples = [tuple(row) for row in df.itertuples(index=False)]
+        # Connect to the PostgreSQL database
+        conn = psycopg2.connect(**DB_CFG)
+        record_count = 0
         
-        # Insert data into the database
-        with conn.cursor() as cur:
-            # Construct the INSERT query
-            columns_str = ', '.join(columns)
+        # Create the tables and load every batch in a single transaction
+        with conn, conn.cursor() as cur:
+            # Create tables if they don't exist
+            create_table(cur)
             
-            insert_query = f"""
-            INSERT INTO current_weather ({columns_str})
-            VALUES %s
-            """
+            # Start from an empty staging table; this also locks it against
+            # concurrent runs until the transaction ends
+            cur.execute(TRUNCATE_STAGE_SQL)
             
-            execute_values(cur, insert_query, data_tuples)
-            conn.commit()
-        
-        # Close the database connection
-        conn.close()
+            for df in itertools.chain([first_batch], batches):
+                stage_batch(cur, df)
+                record_count += len(df)
+            
+            # Move the staged rows into the WAL-logged target table
+            cur.execute(MOVE_STAGE_SQL)
+            
+            # Leave the staging table empty once the rows have been moved
+            cur.execute(TRUNCATE_STAGE_SQL)
         
-        logger.info(f"Successfully loaded {len(df)} weather records into PostgreSQL")
+        logger.info(f"Successfully loaded {record_count} weather records into PostgreSQL")
     
     except Exception as e:
         logger.error(f"Error loading data: {e}")
         raise
+    
+    finally:
+        # Close the database connection, also when loading failed
+        if conn is not None:
+            conn.close()
+
+def put_unless_stopped(q, item, stopped):
+    """
+    Put item on the bounded queue q, waiting while it is full
+    Returns False without putting it once stopped() reports the consumer is gone
+    """
+    while not stopped():
+        try:
+            q.put(item, timeout=QUEUE_POLL_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def read_stream(q):
+    """
+    Yield items from q until the end-of-stream marker
+    Raises RuntimeError if an upstream stage aborted the stream
+    """
+    while True:
+        item = q.get()
+        if item is STREAM_END:
+            return
+        if item is STREAM_ABORT:
+            raise RuntimeError("Upstream pipeline stage failed")
+        yield item
+
+def transform_worker(q_raw, q_load, loader_stopped):
+    """
+    Consume (city, weather JSON) pairs from q_raw, transform them in batches
+    and put the resulting DataFrames on q_load while loader_stopped() is False
+    """
+    batch = []
+    batch_started = None
+    
+    def flush():
+        if not put_unless_stopped(q_load, transform(build_dataframe(batch)), loader_stopped):
+            raise RuntimeError("Load stage stopped")
+        batch.clear()
+    
+    completed = False
+    try:
+        while True:
+            # Wait no longer than the current batch is allowed to age
+            timeout = None
+            if batch:
+                timeout = max(0, BATCH_TIMEOUT - (time.monotonic() - batch_started))
+            
+            try:
+                record = q_raw.get(timeout=timeout)
+            except queue.Empty:
+                flush()
+                continue
+            
+            if record is STREAM_ABORT:
+                return
+            if record is STREAM_END:
+                break
+            
+            if not batch:
+                batch_started = time.monotonic()
+            batch.append(record)
+            
+            if len(batch) >= BATCH_SIZE:
+                flush()
+        
+        if batch:
+            flush()
+        completed = True
+    
+    except Exception as e:
+        logger.error(f"Error in transform worker: {e}")
+        raise
+    
+    finally:
+        # End the load stream; anything but a clean finish rolls back the load
+        put_unless_stopped(q_load, STREAM_END if completed else STREAM_ABORT, loader_stopped)
 
 def run_etl_pipeline():
     """
     Run the complete ETL pipeline for weather data
+
+    Extract, transform and load run concurrently: each city's payload is
+    handed to the transform worker as soon as it arrives, and transformed
+    batches are streamed to the loader, which commits once at the end.
     """
     logger.info("Starting Weather ETL pipeline...")
     
     try:
-        # Extract
-        raw_data = extract()
-        
-        # Transform
-        transformed_data = transform(raw_data)
+        q_raw = queue.Queue(maxsize=RAW_QUEUE_SIZE)
+        q_load = queue.Queue(maxsize=LOAD_QUEUE_SIZE)
         
-        # Load
-        load(transformed_data)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            # Load and transform stages; either finishing before the stream
+            # has ended means it failed
+            loader = executor.submit(load_batches, read_stream(q_load))
+            transformer = executor.submit(transform_worker, q_raw, q_load, loader.done)
+            
+            def downstream_stopped():
+                return transformer.done() or loader.done()
+            
+            # Extract stage; stop fetching as soon as a downstream stage dies
+            completed = False
+            records = extract_stream()
+            try:
+                for record in records:
+                    if not put_unless_stopped(q_raw, record, downstream_stopped):
+                        break
+                else:
+                    completed = True
+            finally:
+                records.close()
+                # End the raw stream; anything but a clean finish rolls back the load
+                put_unless_stopped(q_raw, STREAM_END if completed else STREAM_ABORT, transformer.done)
+            
+            transformer.result()
+            loader.result()
         
         logger.info("Weather ETL pipeline completed successfully")
     